@@ -0,0 +1,7 @@
+"""Allows running the CLI with python -m beyondInsight"""
+
+import sys
+
+from .cli import main
+
+sys.exit(main())
@@ -0,0 +1,228 @@
+"""Agent Module, serves secrets kept in memory to local processes over a Unix socket"""
+
+import json
+import logging
+import os
+import signal
+import socketserver
+import stat
+import threading
+import time
+
+from . import client, controller, settings, utils
+
+# Secrets by normalized path, with the time they were fetched, replaced as a whole on every refresh.
+secrets_index = {}
+
+def normalize_path(path):
+    """
+    Normalize secret path used as index key
+    Arguments:
+        Secret path
+    Returns
+        Normalized path
+    """
+
+    return path.replace('\\', "/").strip("/").lower()
+
+def index_secrets(secrets_lines, refreshed_at):
+    """
+    Index secrets by path
+    Arguments:
+        Secrets as json lines
+        Fetch time, as unix timestamp
+    Returns
+        Secrets and fetch time by normalized path (folder path/title or system name/account name)
+    """
+
+    index = {}
+    for line in secrets_lines.splitlines():
+        if not line.strip():
+            continue
+        secret = json.loads(line)
+        path = secret["FolderPath"]
+        if "Title" in secret:
+            path = f"{path}/{secret['Title']}"
+        index[normalize_path(path)] = {"secret": secret, "refreshed_at": refreshed_at}
+    return index
+
+def refresh_secrets():
+    """
+    Fetch secrets from BeyondInsight and replace the in memory secrets
+    Arguments:
+    Returns
+        Status of the action, False if the fetch failed or logged errors
+    """
+
+    global secrets_index
+
+    refreshed_at = time.time()
+    logs, secrets_lines = controller.get_secrets_and_logs("jsonl")
+    if secrets_lines is None:
+        utils.log("Agent: Error refreshing secrets, keeping previous secrets", logging.ERROR)
+        return False
+
+    index = index_secrets(secrets_lines, refreshed_at)
+    errors = [log for log in logs if log['type'] == 'ERROR']
+    failed_paths = [normalize_path(log['path']) for log in errors if log.get('path')]
+    # Errors without a path, like a failed managed accounts listing, may concern any secret.
+    keep_all_missing = any(not log.get('path') for log in errors)
+
+    # Secrets whose own fetch failed keep their previous value and fetch time, the others are dropped.
+    kept = 0
+    for path, entry in secrets_index.items():
+        if path in index:
+            continue
+        if keep_all_missing or any(path == failed_path or path.startswith(f"{failed_path}/")
+                                   for failed_path in failed_paths):
+            index[path] = entry
+            kept += 1
+
+    secrets_index = index
+    utils.log(f"Agent: Secrets refreshed, number of secrets {len(index) - kept}, "
+              f"previous secrets kept {kept}, errors {len(errors)}",
+              logging.ERROR if errors else logging.INFO)
+    return not errors
+
+def refresh_secrets_periodically(stop_event, refresh_interval):
+    """
+    Refresh secrets until stop event is set
+    Arguments:
+        Stop event
+        Refresh interval in seconds
+    Returns
+    """
+
+    while not stop_event.wait(refresh_interval):
+        try:
+            refresh_secrets()
+        except Exception as error:
+            utils.log(f"Agent: Error refreshing secrets: {error}", logging.ERROR)
+
+def lookup_secret(request):
+    """
+    Find secret requested by path or by system name and account name
+    Arguments:
+        Request, {"path": ...} or {"system_name": ..., "account_name": ...}
+    Returns
+        Response, {"secret": ..., "refreshed_at": ...} with null secret when not found, or {"error": ...}
+    """
+
+    if not isinstance(request, dict):
+        return {"error": "Invalid request"}
+
+    path = request.get("path")
+    if not path and request.get("system_name") and request.get("account_name"):
+        path = f"{request['system_name']}/{request['account_name']}"
+
+    if not path:
+        return {"error": "Invalid request, path or system_name and account_name are required"}
+
+    entry = secrets_index.get(normalize_path(path))
+    if entry is None:
+        return {"secret": None, "refreshed_at": None}
+    return entry
+
+
+class SecretsRequestHandler(socketserver.StreamRequestHandler):
+    """Answers json line requests until the client closes the connection"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = lookup_secret(json.loads(line))
+            except ValueError:
+                response = {"error": "Invalid request, json expected"}
+            self.wfile.write(json.dumps(response, separators=(',', ':')).encode() + b"\n")
+            self.wfile.flush()
+
+
+class SecretsServer(socketserver.ThreadingUnixStreamServer):
+    """Unix socket server, one thread per connection"""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def prepare_socket_path(socket_path):
+    """
+    Create the socket folder and remove a stale socket, if they are safe to use
+    Arguments:
+        Socket path
+    Returns
+        Error message, None if the path is safe to bind
+    """
+
+    uid = os.getuid()
+    folder = os.path.dirname(os.path.abspath(socket_path))
+
+    if not os.path.exists(folder):
+        os.makedirs(folder, mode=0o700, exist_ok=True)
+
+    folder_stat = os.stat(folder)
+    if folder_stat.st_uid not in (uid, 0):
+        return f"socket folder {folder} is owned by user id {folder_stat.st_uid}"
+    # Others could replace the socket in a folder they can write, unless it is sticky like /tmp.
+    if folder_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH) and not folder_stat.st_mode & stat.S_ISVTX:
+        return f"socket folder {folder} is writable by other users"
+
+    if os.path.lexists(socket_path):
+        socket_stat = os.lstat(socket_path)
+        if socket_stat.st_uid != uid:
+            return f"{socket_path} exists and is owned by user id {socket_stat.st_uid}"
+        if not stat.S_ISSOCK(socket_stat.st_mode):
+            return f"{socket_path} exists and is not a socket"
+        os.remove(socket_path)
+
+    return None
+
+def serve(socket_path=None, refresh_interval=None):
+    """
+    Fetch secrets and serve them over a Unix socket, refreshing them in background
+    Arguments:
+        Socket path, client.AGENT_SOCKET_PATH by default
+        Refresh interval in seconds, settings.AGENT_REFRESH_INTERVAL by default
+    Returns
+        False if the agent could not start
+    """
+
+    socket_path = socket_path or client.AGENT_SOCKET_PATH
+    refresh_interval = refresh_interval or settings.AGENT_REFRESH_INTERVAL
+
+    error = prepare_socket_path(socket_path)
+    if error:
+        utils.log(f"Agent: Refusing to start, {error}", logging.ERROR)
+        return False
+
+    if not refresh_secrets():
+        utils.log("Agent: Initial fetch failed, secrets will be served after the next refresh", logging.ERROR)
+
+    stop_event = threading.Event()
+    # Only the owner of the agent can read secrets, the socket is created with 0600 permissions.
+    umask = os.umask(0o177)
+    try:
+        server = SecretsServer(socket_path, SecretsRequestHandler)
+    finally:
+        os.umask(umask)
+
+    try:
+        # Signal handlers can only be installed from the main thread.
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+
+        refresh_thread = threading.Thread(target=refresh_secrets_periodically,
+                                          args=(stop_event, refresh_interval), daemon=True)
+        refresh_thread.start()
+
+        utils.log(f"Agent: Serving secrets on {socket_path}, refresh interval {refresh_interval} seconds", logging.INFO)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        utils.log("Agent: Stopped", logging.INFO)
+
+    return True
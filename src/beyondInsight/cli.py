@@ -0,0 +1,159 @@
+"""CLI Module, command line entry point to fetch secrets"""
+
+import argparse
+import cProfile
+import json
+import logging
+import os
+import pstats
+import sys
+
+OUTPUT_FORMATS = ("json", "compact", "dotenv", "jsonl")
+
+def parse_arguments(arguments=None):
+    """
+    Parse command line arguments
+    Arguments:
+        Command line arguments, sys.argv by default
+    Returns
+        Parsed arguments
+    """
+
+    parser = argparse.ArgumentParser(
+        prog="beyondInsight",
+        description="Fetch secrets from BeyondInsight. Connection settings (BT_API_URL, BT_API_KEY, ...) "
+                    "are read from environment variables, options below override them.")
+    parser.add_argument("--secrets", help="Comma separated secrets paths, overrides SECRETS_LIST")
+    parser.add_argument("--folders", help="Comma separated folders paths, overrides FOLDER_LIST")
+    parser.add_argument("--managed-accounts",
+                        help="Comma separated system name/account name list, overrides MANAGED_ACCOUNTS_LIST")
+    parser.add_argument("--no-fetch-all-managed-accounts", action="store_true",
+                        help="Do not fetch all managed accounts when no managed account list is given")
+    parser.add_argument("-c", "--concurrency", type=int,
+                        help="Number of secrets fetched at the same time, overrides MAX_WORKERS")
+    parser.add_argument("--page-size", type=int, help="Listings page size, overrides PAGE_SIZE")
+    parser.add_argument("-f", "--format", choices=OUTPUT_FORMATS, default="json",
+                        help="Output format: nested json, compact json, dotenv or json lines (default: json)")
+    parser.add_argument("-o", "--output", help="Write secrets to this file instead of stdout")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Print the request plan and the number of API calls, without calling the API")
+    parser.add_argument("--agent", action="store_true",
+                        help="Keep secrets in memory and serve them over a Unix socket, refreshing them in background")
+    parser.add_argument("--socket", help="Agent Unix socket path, overrides AGENT_SOCKET_PATH")
+    parser.add_argument("--refresh-interval", type=int,
+                        help="Agent refresh interval in seconds, overrides AGENT_REFRESH_INTERVAL")
+    parser.add_argument("--profile", action="store_true", help="Report time spent in each stage to stderr")
+    parser.add_argument("--profile-output", metavar="PATH",
+                        help="Profile the whole run with cProfile, worker threads included, and dump pstats to PATH")
+
+    return parser.parse_args(arguments)
+
+def main(arguments=None):
+    """
+    Command line entry point
+    Arguments:
+        Command line arguments, sys.argv by default
+    Returns
+        Exit code
+    """
+
+    args = parse_arguments(arguments)
+
+    profiler = None
+    if args.profile_output:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    # Imported here, settings are read from environment variables on import.
+    from . import settings, utils
+
+    # Worker threads are profiled separately, their stats are merged at the end.
+    utils.profile_threads = profiler is not None
+
+    # Logs go to stderr, stdout is kept for the secrets.
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.StreamHandler) and handler.stream is sys.stdout:
+            handler.setStream(sys.stderr)
+
+    from . import controller, services
+
+    if args.secrets is not None:
+        settings.SECRETS_LIST = args.secrets
+    if args.folders is not None:
+        settings.FOLDER_LIST = args.folders
+    if args.managed_accounts is not None:
+        settings.MANAGED_ACCOUNTS_LIST = args.managed_accounts
+    if args.no_fetch_all_managed_accounts:
+        settings.FETCH_ALL_MANAGED_ACCOUNTS = False
+    if args.concurrency is not None:
+        settings.MAX_WORKERS = max(args.concurrency, 1)
+    if args.page_size is not None:
+        settings.PAGE_SIZE = max(args.page_size, 1)
+
+    # The connection pool must fit the concurrency set above.
+    services.mount_connection_pool()
+
+    if args.agent:
+        from . import agent
+        return 0 if agent.serve(args.socket, args.refresh_interval) else 1
+
+    exit_code = 0
+
+    with utils.stage_timer("total"):
+        if args.dry_run:
+            plan = controller.build_request_plan(settings.SECRETS_LIST.lower(),
+                                                 settings.FOLDER_LIST.lower(),
+                                                 settings.MANAGED_ACCOUNTS_LIST.lower())
+            write_output(json.dumps(plan, indent=4), args.output)
+        else:
+            secrets = controller.get_secrets(args.format)
+            if secrets is None:
+                exit_code = 1
+            else:
+                write_output(secrets, args.output)
+
+    if profiler:
+        profiler.disable()
+        stats = pstats.Stats(profiler)
+        for thread_profile in utils.thread_profiles:
+            stats.add(thread_profile)
+        stats.dump_stats(args.profile_output)
+        print(f"cProfile stats written to {args.profile_output}", file=sys.stderr)
+
+    if args.profile or args.profile_output:
+        print_stage_timings(utils.stage_timings)
+
+    return exit_code
+
+def write_output(content, output_path=None):
+    """
+    Write content to a file or stdout
+    Arguments:
+        Content
+        Output file path, stdout if not given
+    Returns
+    """
+
+    if output_path:
+        # Secrets are only readable by the owner, even if the file already existed.
+        descriptor = os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(descriptor, 0o600)
+        with os.fdopen(descriptor, "w") as output_file:
+            output_file.write(content)
+            output_file.write("\n")
+        return
+
+    sys.stdout.write(content)
+    sys.stdout.write("\n")
+
+def print_stage_timings(stage_timings):
+    """
+    Print time spent in each stage to stderr
+    Arguments:
+        Stage timings
+    Returns
+    """
+
+    print("stage              seconds", file=sys.stderr)
+    for stage, seconds in stage_timings.items():
+        print(f"{stage:<18} {seconds:>8.3f}", file=sys.stderr)
@@ -0,0 +1,95 @@
+"""Client Module, gets secrets from a running agent"""
+
+import json
+import os
+import socket
+import struct
+
+# Settings are not imported, clients do not need BeyondInsight credentials.
+env = os.environ
+
+# Per user socket, in the runtime directory or in a private folder under /tmp.
+if 'XDG_RUNTIME_DIR' in env and env['XDG_RUNTIME_DIR'].strip():
+    DEFAULT_AGENT_SOCKET_PATH = f"{env['XDG_RUNTIME_DIR']}/beyondInsight.sock"
+else:
+    DEFAULT_AGENT_SOCKET_PATH = f"/tmp/beyondInsight-{os.getuid()}/agent.sock"
+
+AGENT_SOCKET_PATH = env['AGENT_SOCKET_PATH'] if 'AGENT_SOCKET_PATH' in env and env['AGENT_SOCKET_PATH'].strip() else DEFAULT_AGENT_SOCKET_PATH
+
+class AgentError(Exception):
+    """Raised when the agent could not answer a request"""
+
+def get_secret(path=None, system_name=None, account_name=None, socket_path=None, timeout=5):
+    """
+    Get a secret from a running agent
+    Arguments:
+        Secret path (folder path/title), or
+        System name and account name
+        Socket path, AGENT_SOCKET_PATH by default
+        Timeout in seconds
+    Returns
+        Secret object, None if the secret was not found
+    Raises:
+        AgentError if the agent is not running, can not be trusted, did not answer or rejected the request
+    """
+
+    return get_secret_response(path, system_name, account_name, socket_path, timeout)["secret"]
+
+def get_secret_response(path=None, system_name=None, account_name=None, socket_path=None, timeout=5):
+    """
+    Get a secret from a running agent, with the time it was fetched
+    Arguments:
+        Secret path (folder path/title), or
+        System name and account name
+        Socket path, AGENT_SOCKET_PATH by default
+        Timeout in seconds
+    Returns
+        {"secret": ..., "refreshed_at": ...}, refreshed_at is the unix timestamp of the
+        last successful fetch of the secret, secret is None if it was not found
+    Raises:
+        AgentError if the agent is not running, can not be trusted, did not answer or rejected the request
+    """
+
+    request = {"path": path} if path else {"system_name": system_name, "account_name": account_name}
+    socket_path = socket_path or AGENT_SOCKET_PATH
+
+    # Not running, still loading secrets or timed out, callers can fall back to a direct fetch.
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(socket_path)
+            check_agent_user(client)
+            client.sendall(json.dumps(request).encode() + b"\n")
+            with client.makefile("rb") as response_file:
+                response_line = response_file.readline()
+    except OSError as error:
+        raise AgentError(f"Error communicating with the agent on {socket_path}: {error}") from error
+
+    if not response_line:
+        raise AgentError("Agent closed the connection without answering")
+
+    try:
+        response = json.loads(response_line)
+    except ValueError as error:
+        raise AgentError(f"Invalid agent response: {error}") from error
+    if "error" in response:
+        raise AgentError(response["error"])
+    return response
+
+def check_agent_user(client):
+    """
+    Check the agent runs as the current user, where the platform reports it
+    Arguments:
+        Connected socket
+    Returns:
+    Raises:
+        AgentError if the agent runs as another user
+    """
+
+    if not hasattr(socket, "SO_PEERCRED"):
+        return
+
+    credentials = client.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    _, agent_uid, _ = struct.unpack("3i", credentials)
+    if agent_uid != os.getuid():
+        raise AgentError(f"Agent socket is served by user id {agent_uid}, expected {os.getuid()}")
@@ -1,17 +1,31 @@
 """Controller Module, all the logic to process retrieved secrets"""
 
+import contextlib
 import logging
 import traceback
 import json
 
 from . import services, settings, utils
 
-def get_secrets():
+def get_secrets(output_format="json"):
     """
     Get All secrets in folder or get by secret id
     Argulemts:
+        Output format (json, compact, dotenv or jsonl)
     Returns
     """
+
+    return get_secrets_and_logs(output_format)[1]
+
+def get_secrets_and_logs(output_format="json"):
+    """
+    Get All secrets in folder or get by secret id, with the execution logs
+    Argulemts:
+        Output format (json, compact, dotenv or jsonl)
+    Returns
+        Logs, errors mean some secrets could not be retrieved, 'path' tells which ones when known
+        Retrieved secrets, None if the execution failed
+    """
     utils.log(f"APP VERSION: {settings.APP_VERSION}", logging.INFO)
 
     utils.log(f"Starting Execution...{settings.EXCECUTION_ID}", logging.INFO)
@@ -37,31 +51,40 @@ def get_secrets():
         }
     }
 
+    logs = []
+
     try:
         # Call Sign App in service
-        user, error = sign_app_in()
+        with utils.stage_timer("sign_in"):
+            user, error = sign_app_in()
 
         if not error:
             execution_log['input']['user'] = user
 
-            logs, secrets = get_secrets_from_bt(secret_list, folder_list, managed_account_list)
+            logs, secrets = get_secrets_from_bt(secret_list, folder_list, managed_account_list, output_format)
 
             execution_log['output']['errors'] = [log for log in logs if log['type'] == 'ERROR']
             execution_log['output']['messages'] = [log for log in logs if log['type'] == 'INFO']
 
             # Call Sign App Out service
-            if not sign_app_out():
-                utils.log("Eror trying to sign out!", logging.ERROR)
+            with utils.stage_timer("sign_out"):
+                if not sign_app_out():
+                    utils.log("Eror trying to sign out!", logging.ERROR)
 
             execution_log_dump = json.dumps(execution_log, indent=4)
 
             utils.log(execution_log_dump, logging.INFO)
             utils.log(f"Ending Execution... {settings.EXCECUTION_ID}", logging.INFO)
-            return secrets
-        return None
+            return logs, secrets
+        return logs, None
     except Exception as error:
         traceback.print_exc()
         utils.log(f"There was an error in the execution: {error}", logging.ERROR)
+        return logs, None
+    finally:
+        # No request should be left open, even if the execution failed.
+        if not services.flush_check_ins():
+            utils.log("Error trying to check in requests!", logging.ERROR)
 
 
 def sign_app_in():
@@ -82,13 +105,14 @@ def sign_app_out():
 
     return services.sign_app_out()
 
-def get_secrets_from_bt(secrets_list, folder_list, managed_accounts_list):
+def get_secrets_from_bt(secrets_list, folder_list, managed_accounts_list, output_format="json"):
     """
     Get secrets by secret list / folder list and managed accounts list
     Arguments:
         Secret list
         Folder list
         Managed accounts list
+        Output format
     Returns
         Logs
         Retrieved secrets
@@ -99,7 +123,8 @@ def get_secrets_from_bt(secrets_list, folder_list, managed_accounts_list):
 
     if secrets_list or folder_list:
         # Getting (credentials, text and files secrets)
-        logs, secrets = get_secrets_by_folder_path_or_secret_path(secrets_list, folder_list)
+        with utils.stage_timer("secrets"):
+            logs, secrets = get_secrets_by_folder_path_or_secret_path(secrets_list, folder_list)
 
         secrets_to_file.extend(secrets)
         if logs:
@@ -108,18 +133,20 @@ def get_secrets_from_bt(secrets_list, folder_list, managed_accounts_list):
     # Managed Account
     if managed_accounts_list:
         # Getting credentials by system name and account name.
-        logs, secrets = get_secret_by_system_name_and_account_name(managed_accounts_list)
+        with utils.stage_timer("managed_accounts"):
+            logs, secrets = get_secret_by_system_name_and_account_name(managed_accounts_list)
         secrets_to_file.extend(secrets)
         if logs:
             secrets_logs.extend(logs)
     elif settings.FETCH_ALL_MANAGED_ACCOUNTS:
-        managed_accounts_list = get_managed_accounts()
-        # Getting credentials by system name and account name.
-        logs, secrets = get_secret_by_system_name_and_account_name(managed_accounts_list)
+        # Getting credentials of all managed accounts, page by page.
+        with utils.stage_timer("managed_accounts"):
+            logs, secrets = get_all_managed_accounts_secrets()
         secrets_to_file.extend(secrets)
         if logs:
             secrets_logs.extend(logs)
-    secrets = generate_secret_json_array(secrets_to_file)
+    with utils.stage_timer("format"):
+        secrets = format_secrets(secrets_to_file, output_format)
     # log_message = f"Creating files with the secrets as content, number of files {len(secrets_to_file)}"
     # secrets_logs.append({'message': log_message, 'type': 'INFO'})
     # utils.log(f"Secrets folder Path {settings.SECRETS_PATH}", logging.INFO)
@@ -147,74 +174,148 @@ def get_secrets_by_folder_path_or_secret_path(secrets_by_secret_path, secrets_by
     secrets_logs = []
 
     if secrets_by_secret_path:
-        paths = secrets_by_secret_path.split(",")
-        for secret_path in paths:
-            if secret_path == "":
-                continue
-            folders_in_path = secret_path.strip().split(separator)
-            title = folders_in_path[-1]
-            path = separator.join(folders_in_path[:-1])
-            # Checking if it is a single password.
-            response = services.get_secret_by_path(path, title, separator)
-            
-            if not response:
-                utils.log(f"Secret {path}/{title} was not Found, Validating Folder: {folders_in_path}", logging.INFO)
-                response = services.get_secret_by_path(separator.join(folders_in_path), title, separator, False)
-
-                if not response:
-                    log_message = f"Invalid path or Invalid Secret: {secret_path}"
-                    secrets_logs.append({
-                        'message': log_message,
-                        'type': "ERROR"
-                        })
-                    utils.log(log_message, logging.ERROR)
-                    continue
-
-                for secret in response:
-                    
-                    secret_object = get_secrets_in_folder(secret)
-                    if secret_object:
-                        secrets.append(secret_object)
-
-            elif response[0]['SecretType'] == "File":
-                file = services.get_secret_file_by_id(response[0]['Id'])
-                if not file:
-                    log_message = f"Error Getting File secret, secret metadata: {response[0]}"
-                    utils.log(log_message, logging.ERROR)
-                    continue
-                secrets.append(utils.create_secret_file(response[0], file))
+        paths = split_list(secrets_by_secret_path)
 
-            else:
-                secrets.append(utils.convert_secret_to_object(response[0]))
+        results = utils.map_concurrently(get_secrets_by_secret_path, paths)
+        for secret_path, (log_message, path_secrets) in zip(paths, results):
+            if log_message:
+                secrets_logs.append({
+                    'message': log_message,
+                    'type': "ERROR",
+                    'path': secret_path
+                    })
+            secrets.extend(path_secrets)
 
     if secrets_by_folder_path:
         # Getting secrets by folder
         
-        folders =  secrets_by_folder_path.split(",")
+        folders = split_list(secrets_by_folder_path)
         utils.log(f"Getting secrets by folders {folders}", logging.INFO)
 
     
         for folder in folders:
             
-            response = services.get_secret_by_path(folder, "", separator, False)
+            log_message, folder_secrets = get_secrets_by_folder(folder, separator)
 
-            if not response:
-                log_message = f"Invalid path or Invalid Secret: {folder}"
+            if log_message:
                 secrets_logs.append({
                     'message': log_message,
-                    'type': "ERROR"
+                    'type': "ERROR",
+                    'path': folder
                     })
-                utils.log(log_message, logging.ERROR)
-                continue
 
-            for secret in response:
-                secret_object = get_secrets_in_folder(secret)
-                if secret_object:
-                    secrets.append(secret_object)
+            secrets.extend(folder_secrets)
 
     return secrets_logs, secrets
 
 
+def split_list(items):
+    """
+    Split a comma separated list, used by the execution and the request plan
+    Arguments:
+        Comma separated list
+    Returns
+        Stripped items, empty items are skipped
+    """
+
+    return [item.strip() for item in items.split(",") if item.strip()]
+
+
+def parse_managed_accounts_list(system_name_account_name):
+    """
+    Parse a comma separated system name/account name list
+    Arguments:
+        Managed accounts list
+    Returns
+        Valid items as system name/account name
+        Rejected items
+    """
+
+    secret_paths = []
+    rejected_items = []
+
+    for system_name_account_name_item in split_list(system_name_account_name):
+        if len(system_name_account_name_item.split("/")) != 2:
+            rejected_items.append(system_name_account_name_item)
+            continue
+        secret_paths.append(system_name_account_name_item)
+
+    return secret_paths, rejected_items
+
+
+def get_secrets_by_secret_path(secret_path, separator='/'):
+    """
+    Get secret by secret path, or all secrets in it if the path is a folder
+    Arguments:
+        Secret path
+        Separator
+    Returns
+        Error message, None if there was no error
+        Retrieved secrets
+    """
+
+    folders_in_path = secret_path.strip().split(separator)
+    title = folders_in_path[-1]
+    path = separator.join(folders_in_path[:-1])
+    # Checking if it is a single password.
+    response = services.get_secret_by_path(path, title, separator)
+
+    if not response:
+        utils.log(f"Secret {path}/{title} was not Found, Validating Folder: {folders_in_path}", logging.INFO)
+        return get_secrets_by_folder(separator.join(folders_in_path), separator)
+
+    if response[0]['SecretType'] == "File":
+        file = services.get_secret_file_by_id(response[0]['Id'])
+        if not file:
+            log_message = f"Error Getting File secret, secret metadata: {response[0]}"
+            utils.log(log_message, logging.ERROR)
+            return log_message, []
+        return None, [utils.create_secret_file(response[0], file)]
+
+    return None, [utils.convert_secret_to_object(response[0])]
+
+
+def get_secrets_by_folder(folder, separator):
+    """
+    Get all secrets in a folder, processing each page as soon as it arrives
+    Arguments:
+        Folder path
+        Separator
+    Returns
+        Error message, None if there was no error
+        Retrieved secrets, partial if the listing failed after the first page
+    """
+
+    secrets = []
+    found = False
+    failed_files = 0
+
+    try:
+        with contextlib.closing(utils.prefetch(services.get_secrets_by_folder_pages(folder, separator))) as pages:
+            for page in pages:
+                found = True
+                for secret_object in utils.map_concurrently(get_secrets_in_folder, page):
+                    if secret_object:
+                        secrets.append(secret_object)
+                    else:
+                        failed_files += 1
+    except services.ListingError as error:
+        if found:
+            log_message = f"Partial listing of folder {folder}, {len(secrets)} secrets retrieved: {error}"
+            utils.log(log_message, logging.ERROR)
+            return log_message, secrets
+
+    if not found:
+        log_message = f"Invalid path or Invalid Secret: {folder}"
+        utils.log(log_message, logging.ERROR)
+        return log_message, []
+
+    if failed_files:
+        return f"Error Getting {failed_files} File secrets in folder {folder}", secrets
+
+    return None, secrets
+
+
 def get_secrets_in_folder(secret):
     """
     Get specific secret object as json
@@ -252,51 +353,140 @@ def get_secret_by_system_name_and_account_name(system_name_account_name):
     secrets = []
     secrets_logs = []
 
-    system_name_account_name_items = system_name_account_name.split(",")
-
-    for system_name_account_name_item in system_name_account_name_items:
+    secret_paths, rejected_items = parse_managed_accounts_list(system_name_account_name)
 
-        data = system_name_account_name_item.strip().split("/")
+    for system_name_account_name_item in rejected_items:
+        log_message = f"Invalid Managed Account: {system_name_account_name_item}"
+        secrets_logs.append({
+            'message': log_message,
+            'type': "ERROR",
+            'path': system_name_account_name_item
+            })
+        utils.log(log_message, logging.ERROR)
 
-        if len(data) != 2:
-            log_message = f"Invalid Managed Account: {system_name_account_name_item.strip()}"
+    results = utils.map_concurrently(get_managed_account_secret, secret_paths)
+    for secret_path, (log_message, secret) in zip(secret_paths, results):
+        if log_message:
             secrets_logs.append({
                 'message': log_message,
-                'type': "ERROR"
+                'type': "ERROR",
+                'path': secret_path
                 })
-            utils.log(log_message, logging.ERROR)
             continue
+        secrets.append(secret)
 
-        system_name = data[0]
-        account_name = data[1]
+    return secrets_logs, secrets
 
-        secret_path = f"{system_name}/{account_name}"
+def get_managed_account_secret(secret_path):
+    """
+    Get secret by system name and account name
+    Arguments:
+        Secret path, as system name/account name
+    Returns
+        Error message, None if there was no error
+        Retrieved secret
+    """
 
-        manage_account = services.get_managed_accounts(
-            system_name, account_name)
-        if manage_account is None or manage_account == 'Managed Account not found':
-            log_message = f"Invalid Managed Account: {secret_path}"
-            secrets_logs.append({
-                'message': log_message,
-                'type': "ERROR"
-                })
-            utils.log(log_message, logging.ERROR)
-            continue
+    system_name, account_name = secret_path.split("/")
+
+    manage_account = services.get_managed_accounts(
+        system_name, account_name)
+    if manage_account is None or manage_account == 'Managed Account not found':
+        log_message = f"Invalid Managed Account: {secret_path}"
+        utils.log(log_message, logging.ERROR)
+        return log_message, None
+
+    return checkout_managed_account(manage_account)
+
+def get_all_managed_accounts_secrets():
+    """
+    Get secrets of all managed accounts, checking out each page as soon as it arrives
+    Arguments:
+    Returns
+        Logs
+        Retrieved secrets
+    """
 
-        request_id = services.create_request_in_password_safe(
-            manage_account['SystemId'], manage_account['AccountId'])
+    secrets = []
+    secrets_logs = []
 
-        credential = services.get_credential_by_request_id(request_id)
-        secrets.append(utils.convert_managed_account_to_object(manage_account, credential))
-        services.request_check_in(request_id)
+    try:
+        with contextlib.closing(utils.prefetch(services.get_managed_accounts_pages())) as pages:
+            for page in pages:
+                results = utils.map_concurrently(checkout_managed_account, page)
+                for manage_account, (log_message, secret) in zip(page, results):
+                    if log_message:
+                        secrets_logs.append({
+                            'message': log_message,
+                            'type': "ERROR",
+                            'path': f"{manage_account['SystemName']}/{manage_account['AccountName']}"
+                            })
+                        continue
+                    secrets.append(secret)
+    except services.ListingError as error:
+        log_message = f"Error listing managed accounts, {len(secrets)} secrets retrieved: {error}"
+        secrets_logs.append({
+            'message': log_message,
+            'type': "ERROR"
+            })
+        utils.log(log_message, logging.ERROR)
 
     return secrets_logs, secrets
 
-def generate_secret_json_array(secrets):
+def checkout_managed_account(manage_account):
+    """
+    Checkout managed account credential
+    Arguments:
+        Managed account
+    Returns
+        Error message, None if there was no error
+        Secret object
+    """
+
+    secret_path = f"{manage_account['SystemName']}/{manage_account['AccountName']}"
+
+    request_id = services.create_request_in_password_safe(
+        manage_account['SystemId'], manage_account['AccountId'])
+    if request_id is None:
+        log_message = f"Error creating request for Managed Account: {secret_path}"
+        utils.log(log_message, logging.ERROR)
+        return log_message, None
+
+    credential = services.get_credential_by_request_id(request_id)
+    # Check in is sent in background, it is flushed before signing out.
+    services.enqueue_check_in(request_id)
+
+    if credential is None:
+        log_message = f"Error getting credential for Managed Account: {secret_path}"
+        utils.log(log_message, logging.ERROR)
+        return log_message, None
+
+    return None, utils.convert_managed_account_to_object(manage_account, credential)
+
+def format_secrets(secrets, output_format="json"):
+    """
+    Format retrieved secrets
+    Arguments:
+        Secrets
+        Output format (json, compact, dotenv or jsonl)
+    Returns
+        Formatted secrets
+    """
+
+    if output_format == "compact":
+        return generate_secret_json_array(secrets, None)
+    if output_format == "dotenv":
+        return utils.secrets_to_dotenv(secrets)
+    if output_format == "jsonl":
+        return utils.secrets_to_json_lines(secrets)
+    return generate_secret_json_array(secrets)
+
+def generate_secret_json_array(secrets, indent=4):
     """
     Generate Secrets Json
     Arguments:
         Secrets
+        Indent, None for compact json
     Returns
         Secrets Json
     """
@@ -318,13 +508,66 @@ def generate_secret_json_array(secrets):
         if "Title" in item:
             current_dict[item["Title"]] = item
     
-    result_json = json.dumps(parent_child_dict, indent=4)
+    if indent is None:
+        return json.dumps(parent_child_dict, separators=(',', ':'))
+
+    result_json = json.dumps(parent_child_dict, indent=indent)
     return result_json
 
 def get_managed_accounts():
+    """
+    Get all managed accounts as a list of system name/account name
+    Arguments:
+    Returns
+        Comma separated managed accounts
+    """
+
     separator = ','
     manage_account_list = []
-    managed_accounts = services.get_managed_accounts("", "")
-    for managed_account in managed_accounts:
-        manage_account_list.append(f"{managed_account['SystemName']}/{managed_account['AccountName']}")
-    return separator.join(manage_account_list)
\ No newline at end of file
+    for page in services.get_managed_accounts_pages():
+        for managed_account in page:
+            manage_account_list.append(f"{managed_account['SystemName']}/{managed_account['AccountName']}")
+    return separator.join(manage_account_list)
+
+def build_request_plan(secrets_list, folder_list, managed_accounts_list):
+    """
+    Build the plan of API calls an execution will make, without calling the API
+    Arguments:
+        Secret list
+        Folder list
+        Managed accounts list
+    Returns
+        Request plan, listings and file downloads only count their first call
+    """
+
+    steps = [{'stage': 'sign_in', 'target': settings.BT_API_URL, 'api_calls': 1, 'exact': True}]
+    rejected = []
+
+    for secret_path in split_list(secrets_list):
+        # Folder fallback and file download are only known after the first call.
+        steps.append({'stage': 'secret', 'target': secret_path, 'api_calls': 1, 'exact': False})
+
+    for folder in split_list(folder_list):
+        steps.append({'stage': 'folder', 'target': folder, 'api_calls': 1, 'exact': False})
+
+    if managed_accounts_list:
+        secret_paths, rejected_items = parse_managed_accounts_list(managed_accounts_list)
+        for secret_path in secret_paths:
+            # Lookup, request, credential and check in.
+            steps.append({'stage': 'managed_account', 'target': secret_path, 'api_calls': 4, 'exact': True})
+        for system_name_account_name_item in rejected_items:
+            rejected.append({'target': system_name_account_name_item,
+                             'message': f"Invalid Managed Account: {system_name_account_name_item}"})
+    elif settings.FETCH_ALL_MANAGED_ACCOUNTS:
+        steps.append({'stage': 'all_managed_accounts', 'target': f"page size {settings.PAGE_SIZE}",
+                      'api_calls': 1, 'exact': False})
+
+    steps.append({'stage': 'sign_out', 'target': settings.BT_API_URL, 'api_calls': 1, 'exact': True})
+
+    return {
+        'steps': steps,
+        'rejected': rejected,
+        'api_calls': sum(step['api_calls'] for step in steps),
+        'exact': all(step['exact'] for step in steps),
+        'concurrency': settings.MAX_WORKERS,
+    }
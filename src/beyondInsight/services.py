@@ -1,8 +1,14 @@
 """Servcie Module, communication with external API's, components"""
 
+import atexit
 import logging
+import threading
+import time
 import requests
 
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
@@ -19,6 +25,29 @@ if not settings.BT_VERIFY_CA:
 
     req.verify = False
 
+def mount_connection_pool():
+    """
+    Size the session connection pool for all the threads sharing it
+    Arguments:
+    Returns:
+    """
+
+    # Fetch workers, check-in workers and the listing prefetch thread.
+    pool_size = settings.MAX_WORKERS + settings.CHECK_IN_WORKERS + 1
+    adapter = HTTPAdapter(pool_maxsize=pool_size)
+    req.mount("https://", adapter)
+    req.mount("http://", adapter)
+
+mount_connection_pool()
+
+class ListingError(Exception):
+    """Raised when a paginated listing could not be completed"""
+
+# Pending requests check-ins, sent in background and flushed before signing out.
+check_in_executor = None
+check_in_futures = []
+check_in_lock = threading.Lock()
+
 def sign_app_in():
     """
     Sign in to Secret safe API
@@ -46,6 +75,9 @@ def sign_app_out():
         Status of the action
     """
 
+    # Requests must be checked in while the session is still valid.
+    flush_check_ins()
+
     url = f"{settings.BT_API_URL}/Auth/Signout"
 
     # Connection : close - tells the connection pool to close the connection.
@@ -147,6 +179,81 @@ def get_managed_accounts(system_name, account_name):
         utils.log("Eror trying to sign out!")
     return None
 
+def get_managed_accounts_pages(page_size=None):
+    """
+    Get all manage accounts, one page at a time
+    Arguments:
+        Page size
+    Returns:
+        Generator of managed accounts pages
+    """
+
+    url = f"{settings.BT_API_URL}/ManagedAccounts"
+    yield from get_pages(url, "get_managed_accounts_pages", page_size)
+
+def get_secrets_by_folder_pages(path, separator, page_size=None):
+    """
+    Get all secrets in a folder, one page at a time
+    Arguments:
+        Folder Path
+        Separator
+        Page size
+    Returns:
+        Generator of secrets pages
+    """
+
+    url = f"{settings.BT_API_URL}/secrets-safe/secrets?folderpath={path}&separator={separator}"
+    yield from get_pages(url, "get_secrets_by_folder_pages", page_size)
+
+def get_pages(url, caller, page_size=None):
+    """
+    Get a listing using limit/offset pagination
+    Arguments:
+        Service URL
+        Caller name, used in logs
+        Page size
+    Returns:
+        Generator of pages, stops on the last page
+    Raises:
+        ListingError if a page could not be retrieved
+    """
+
+    limit = page_size or settings.PAGE_SIZE
+    offset = 0
+    query_separator = '&' if '?' in url else '?'
+    previous_first_record = None
+
+    while True:
+        response = req.get(f"{url}{query_separator}limit={limit}&offset={offset}",
+                           headers=settings.REQUEST_HEADERS)
+
+        if response.status_code != 200:
+            log_message = f"{caller}: Error trying to get page with offset {offset}, url: {url}, response: {response.text}"
+            utils.log(log_message, logging.ERROR)
+            if not sign_app_out():
+                utils.log("Eror trying to sign out!")
+            raise ListingError(log_message)
+
+        page = response.json()
+        total_count = None
+
+        # Paged listings may come wrapped as {"TotalCount": n, "Data": [...]}.
+        if isinstance(page, dict):
+            total_count = page.get('TotalCount')
+            page = page.get('Data') or []
+
+        # A server ignoring offset would send the same page again.
+        if not page or page[0] == previous_first_record:
+            return
+
+        yield page
+
+        previous_first_record = page[0]
+        offset += len(page)
+        # A page bigger than the limit means the server ignored it and sent the whole listing.
+        if len(page) != limit or (total_count is not None and offset >= total_count):
+            return
+
 def create_request_in_password_safe(system_id, account_id):
     """
     Create request by system id and account id
@@ -197,11 +304,12 @@ def get_credential_by_request_id(request_id):
     return None
 
 
-def request_check_in(request_id):
+def request_check_in(request_id, sign_out_on_error=True):
     """
     Expire request
     Arguments:
         Request id
+        Sign out when the check in fails
     Returns:
         Informative text
     """
@@ -212,6 +320,64 @@ def request_check_in(request_id):
         return True
 
     utils.log(f"request_check_in: Error trying to check in by reuqest id {request_id}, response: {response.text}", logging.ERROR)
-    if not sign_app_out():
+    if sign_out_on_error and not sign_app_out():
         utils.log("Eror trying to sign out!")
-    return None
\ No newline at end of file
+    return None
+
+def enqueue_check_in(request_id):
+    """
+    Queue a request check in to be sent by a background worker
+    Arguments:
+        Request id
+    Returns:
+    """
+
+    global check_in_executor
+
+    if request_id is None:
+        return
+
+    with check_in_lock:
+        if check_in_executor is None:
+            check_in_executor = ThreadPoolExecutor(max_workers=settings.CHECK_IN_WORKERS,
+                                                   thread_name_prefix="check-in")
+        check_in_futures.append(check_in_executor.submit(utils.profiled(request_check_in_with_retries), request_id))
+
+def request_check_in_with_retries(request_id):
+    """
+    Expire request, retrying on failures
+    Arguments:
+        Request id
+    Returns:
+        Status of the action
+    """
+
+    for attempt in range(1, settings.CHECK_IN_RETRIES + 1):
+        try:
+            # Signing out from a worker would invalidate the session of the whole execution.
+            if request_check_in(request_id, sign_out_on_error=False):
+                return True
+        except Exception as error:
+            utils.log(f"request_check_in_with_retries: Error trying to check in by request id {request_id}: {error}", logging.ERROR)
+
+        if attempt < settings.CHECK_IN_RETRIES:
+            time.sleep(0.5 * attempt)
+
+    utils.log(f"request_check_in_with_retries: Request {request_id} could not be checked in after {settings.CHECK_IN_RETRIES} attempts", logging.ERROR)
+    return False
+
+def flush_check_ins():
+    """
+    Wait for all queued requests check ins
+    Arguments:
+    Returns:
+        Status of the action, False if any check in failed
+    """
+
+    with check_in_lock:
+        futures = list(check_in_futures)
+        check_in_futures.clear()
+
+    return all([future.result() for future in futures])
+
+atexit.register(flush_check_ins)
\ No newline at end of file
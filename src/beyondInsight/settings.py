@@ -21,6 +21,19 @@ SECRETS_LIST = env['SECRETS_LIST'] if 'SECRETS_LIST' in env else ""
 FOLDER_LIST = env['FOLDER_LIST'] if 'FOLDER_LIST' in env else ""
 MANAGED_ACCOUNTS_LIST = env['MANAGED_ACCOUNTS_LIST'] if 'MANAGED_ACCOUNTS_LIST' in env else ""
 
+# Number of records requested per page when listing managed accounts or folder secrets.
+PAGE_SIZE = int(env['PAGE_SIZE']) if 'PAGE_SIZE' in env and env['PAGE_SIZE'].strip() else 100
+
+# Number of secrets and managed accounts fetched at the same time.
+MAX_WORKERS = int(env['MAX_WORKERS']) if 'MAX_WORKERS' in env and env['MAX_WORKERS'].strip() else 1
+
+# Agent mode, secrets are kept in memory and served over a Unix socket (client.AGENT_SOCKET_PATH).
+AGENT_REFRESH_INTERVAL = int(env['AGENT_REFRESH_INTERVAL']) if 'AGENT_REFRESH_INTERVAL' in env and env['AGENT_REFRESH_INTERVAL'].strip() else 300
+
+# Requests check-ins are sent in background, these settings control the workers and retries.
+CHECK_IN_WORKERS = int(env['CHECK_IN_WORKERS']) if 'CHECK_IN_WORKERS' in env and env['CHECK_IN_WORKERS'].strip() else 4
+CHECK_IN_RETRIES = int(env['CHECK_IN_RETRIES']) if 'CHECK_IN_RETRIES' in env and env['CHECK_IN_RETRIES'].strip() else 3
+
 BT_CLIENT_CERTIFICATE_PATH = None
 if 'BT_CLIENT_CERTIFICATE_PATH' in env:
     if len(env['BT_CLIENT_CERTIFICATE_PATH']) > 0:
@@ -11,10 +11,18 @@ from . import settings
 import contextlib
 import OpenSSL.crypto
 import os
+import re
+import cProfile
+import functools
 import tempfile
+import threading
+import time
+import queue
 
 import uuid
 
+from concurrent.futures import ThreadPoolExecutor
+
 
 if not settings.EXCECUTION_ID:
     settings.EXCECUTION_ID = uuid.uuid1()
@@ -28,6 +36,17 @@ logging.basicConfig(
     style='{'
     )
 
+# Accumulated seconds spent in each execution stage.
+stage_timings = {}
+
+# Worker threads profiles, collected when the CLI profiles the whole run.
+profile_threads = False
+thread_profiles = []
+thread_profiles_lock = threading.Lock()
+
+# Marks threads running map_concurrently work, nested maps in them run sequentially.
+worker_state = threading.local()
+
 def log(message, level=logging.DEBUG):
     """
     Write log
@@ -133,11 +152,163 @@ def create_folders(path):
     concat_folder = settings.SECRETS_PATH
     for folder in parent_folders:
         concat_folder = f"{concat_folder}/{folder}"
-        if not os.path.exists(concat_folder):
-            os.makedirs(concat_folder)
+        # Files secrets are written concurrently, the folder may be created by another thread.
+        os.makedirs(concat_folder, exist_ok=True)
     return f"{concat_folder}/{secret_name}"
 
 
+def secrets_to_dotenv(secrets):
+    """
+    Convert secrets to dotenv format
+    Arguments:
+        Secrets
+    Returns
+        Secrets as KEY='password' lines, key built from folder path and title
+    """
+
+    lines = []
+    for secret in secrets:
+        path = secret["FolderPath"].replace('\\', "/")
+        if "Title" in secret:
+            path = f"{path}/{secret['Title']}"
+        key = re.sub(r'[^A-Za-z0-9]+', '_', path).strip('_').upper()
+        # Variable names can not start with a digit.
+        if not key or key[0].isdigit():
+            key = f"_{key}"
+        # Single quotes keep $, backticks and backslashes literal when the file is sourced.
+        value = str(secret["Password"] or "").replace("'", "'\\''")
+        lines.append(f"{key}='{value}'")
+    return "\n".join(lines)
+
+def secrets_to_json_lines(secrets):
+    """
+    Convert secrets to json lines format
+    Arguments:
+        Secrets
+    Returns
+        One compact json secret object per line
+    """
+
+    return "\n".join(json.dumps(secret, separators=(',', ':')) for secret in secrets)
+
+def profiled(function):
+    """
+    Profile function when it runs in a worker thread and profile_threads is set
+    Arguments:
+        Function
+    Returns
+        Wrapped function, its profile is added to thread_profiles
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not profile_threads:
+            return function(*args, **kwargs)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows a single active profiler, which already covers all threads.
+            return function(*args, **kwargs)
+
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profiler.disable()
+            with thread_profiles_lock:
+                thread_profiles.append(profiler)
+
+    return wrapper
+
+def map_concurrently(function, items, max_workers=None):
+    """
+    Apply function to all items using up to max workers threads
+    Arguments:
+        Function
+        Items
+        Max workers, settings.MAX_WORKERS by default
+    Returns
+        Results, in the same order of the items
+    """
+
+    max_workers = max_workers or settings.MAX_WORKERS
+    items = list(items)
+
+    # Already inside a worker, running concurrently again would exceed max workers.
+    if max_workers <= 1 or len(items) <= 1 or getattr(worker_state, "active", False):
+        return [function(item) for item in items]
+
+    @profiled
+    def run_in_worker(item):
+        worker_state.active = True
+        return function(item)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(run_in_worker, items))
+
+@contextlib.contextmanager
+def stage_timer(stage):
+    """
+    Measure the time spent in an execution stage
+    Arguments:
+        Stage name
+    Returns:
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_timings[stage] = stage_timings.get(stage, 0.0) + time.perf_counter() - start
+
+def prefetch(pages, depth=1):
+    """
+    Iterate pages while the next ones are loaded in a background thread
+    Arguments:
+        Pages iterable
+        Number of pages to load ahead
+    Returns:
+        Generator of pages
+    """
+
+    pending = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        # Gives up when the consumer stopped, instead of blocking forever.
+        while not stopped.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def load_pages():
+        try:
+            for page in pages:
+                if not put(page):
+                    return
+        except Exception as error:
+            put(error)
+        finally:
+            put(done)
+
+    threading.Thread(target=profiled(load_pages), daemon=True).start()
+
+    try:
+        while True:
+            page = pending.get()
+            if page is done:
+                return
+            if isinstance(page, Exception):
+                raise page
+            yield page
+    finally:
+        stopped.set()
+
 @contextlib.contextmanager
 def pfx_to_pem(pfx_path, pfx_password):
     """